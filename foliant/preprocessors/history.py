@@ -5,12 +5,17 @@ Generates history of releases for some set of Git repositories.
 
 
 import re
+import sys
+from atexit import register
 from datetime import datetime
 from hashlib import md5
+from json import dumps, load
 from markdown import markdown
 from operator import itemgetter
+from os import environ, replace
 from pathlib import Path
 from subprocess import run, PIPE, STDOUT, CalledProcessError
+from threading import Thread, Event
 
 from foliant.preprocessors.base import BasePreprocessor
 from foliant.preprocessors import includes
@@ -36,7 +41,8 @@ class Preprocessor(BasePreprocessor):
         'rss_link': '',
         'rss_description': '',
         'rss_language': 'en-US',
-        'rss_item_title_template': '%repo% %version%'
+        'rss_item_title_template': '%repo% %version%',
+        'watch_interval': 1
     }
 
     tags = 'history',
@@ -46,6 +52,26 @@ class Preprocessor(BasePreprocessor):
 
         self.logger = self.logger.getChild('history')
 
+        self._watch_enable = environ.get('FOLIANT_HISTORY_WATCH', '').lower() in ('1', 'true', 'yes')
+        self._watch_stop = Event()
+        self._watch_thread = None
+        self._watched_statements = []
+        self._watched_rss_files = {}
+        self._repo_fingerprints = {}
+        self._repo_histories = {}
+
+        self._marked_history_pattern = re.compile(
+            r'<!-- history:(?P<id>\d+) -->\n.*?<!-- /history:(?P=id) -->',
+            flags=re.DOTALL
+        )
+
+        self._repo_histories_file_path = (
+            self.project_path / includes.Preprocessor.defaults['cache_dir'] / '_history_cache.json'
+        )
+
+        if self._watch_enable:
+            self._load_repo_histories()
+
         self.logger.debug(f'Preprocessor inited: {self.__dict__}')
 
     def _get_repo_name_from_readme(self, readme_file_path: Path) -> str:
@@ -448,12 +474,184 @@ class Preprocessor(BasePreprocessor):
 
         history_rss += '    </channel>\n</rss>\n'
 
-        with open(self.working_dir / rss_file_subpath, 'w', encoding='utf8') as rss_file:
+        rss_file_path = self.working_dir / rss_file_subpath
+
+        if self._watch_enable and not rss_file_path.exists():
+            rss_file_path = next(self.working_dir.rglob(rss_file_subpath), rss_file_path)
+
+        with open(rss_file_path, 'w', encoding='utf8') as rss_file:
            rss_file.write(history_rss)
 
         return None
 
-    def _process_history(self, options: dict) -> str:
+    def _load_repo_histories(self) -> None:
+        self.logger.debug(f'Loading cached repo histories from {self._repo_histories_file_path}')
+
+        try:
+            with open(self._repo_histories_file_path, encoding='utf8') as repo_histories_file:
+                self._repo_histories = load(repo_histories_file)
+
+        except FileNotFoundError:
+            self.logger.debug('Cached repo histories not found')
+
+        except (OSError, ValueError) as exception:
+            self.logger.warning(f'Cannot load cached repo histories, ignoring them: {exception}')
+
+        return None
+
+    def _save_repo_histories(self) -> None:
+        self.logger.debug(f'Saving cached repo histories to {self._repo_histories_file_path}')
+
+        try:
+            self._repo_histories_file_path.parent.mkdir(parents=True, exist_ok=True)
+
+            self._write_file_atomically(self._repo_histories_file_path, dumps(self._repo_histories))
+
+        except OSError as exception:
+            self.logger.warning(f'Cannot save cached repo histories: {exception}')
+
+        return None
+
+    def _get_repo_fingerprint(self, repo_url: str) -> str or None:
+        if repo_url in self._repo_fingerprints:
+            return self._repo_fingerprints[repo_url]
+
+        self.logger.debug(f'Running git ls-remote command to get refs of repo: {repo_url}')
+
+        try:
+            git_ls_remote = run(
+                f'git ls-remote "{repo_url}"',
+                shell=True,
+                check=True,
+                stdout=PIPE,
+                stderr=STDOUT
+            )
+
+            repo_fingerprint = md5(git_ls_remote.stdout).hexdigest()
+
+        except CalledProcessError as exception:
+            self.logger.debug(f'Cannot get refs of repo, caching disabled for it: {exception.output}')
+
+            repo_fingerprint = None
+
+        self.logger.debug(f'Repo fingerprint: {repo_fingerprint}')
+
+        self._repo_fingerprints[repo_url] = repo_fingerprint
+
+        return repo_fingerprint
+
+    def _get_repo_history(
+        self,
+        repo_url: str,
+        revision: str,
+        name_from_readme_enable: bool,
+        readme_file_subpath: str,
+        data_source: str,
+        merge_commits_enable: bool,
+        changelog_file_subpath: str,
+        source_heading_level: int
+    ) -> list or None:
+        repo_history_key = dumps([
+            repo_url,
+            revision,
+            name_from_readme_enable,
+            readme_file_subpath,
+            data_source,
+            merge_commits_enable,
+            changelog_file_subpath,
+            source_heading_level
+        ])
+
+        repo_fingerprint = None
+
+        if self._watch_enable:
+            repo_fingerprint = self._get_repo_fingerprint(repo_url)
+
+            cached_repo_history = self._repo_histories.get(repo_history_key)
+
+            if (
+                repo_fingerprint is not None
+                and
+                cached_repo_history
+                and
+                cached_repo_history['fingerprint'] == repo_fingerprint
+            ):
+                self.logger.debug(f'Repo has not changed, using cached history: {repo_url}')
+
+                return cached_repo_history['history']
+
+        self.logger.debug('Calling Includes preprocessor to fetch from Git repo')
+
+        repo_path = includes.Preprocessor(
+            self.context,
+            self.logger
+        )._sync_repo(repo_url, revision)
+
+        self.logger.debug(f'Repo URL: {repo_url}, path: {repo_path}')
+
+        repo_name = None
+
+        if name_from_readme_enable:
+            self.logger.debug('Trying to get repo name from README')
+
+            readme_file_path = (repo_path / readme_file_subpath).resolve()
+
+            self.logger.debug(f'Full README file path: {readme_file_path}')
+
+            if readme_file_path.exists():
+                repo_name = self._get_repo_name_from_readme(readme_file_path)
+
+            else:
+                self.logger.debug('README file not found')
+
+        if not repo_name:
+            self.logger.debug('Getting repo name from repo URL')
+
+            repo_name = repo_url.split('/')[-1].rsplit('.', maxsplit=1)[0]
+
+        self.logger.debug(f'Repo name: {repo_name}')
+
+        self.logger.debug(f'Getting repo history, data source: {data_source}')
+
+        repo_history = None
+
+        if data_source == 'changelog':
+            changelog_file_path = (repo_path / changelog_file_subpath).resolve()
+
+            self.logger.debug(f'Full changelog file path: {changelog_file_path}')
+
+            if changelog_file_path.exists():
+                repo_history = self._get_repo_history_from_changelog(
+                    repo_url, repo_name, changelog_file_path, source_heading_level
+                )
+
+            else:
+                self.logger.debug('Changelog file not found')
+
+        elif data_source == 'tags':
+            repo_history = self._get_repo_history_from_tags(
+                repo_url, repo_name, repo_path.resolve()
+            )
+
+        elif data_source == 'commits':
+            repo_history = self._get_repo_history_from_commits(
+                repo_url, repo_name, repo_path.resolve(), merge_commits_enable
+            )
+
+        else:
+            self.logger.debug('Unsupported data source')
+
+        if repo_fingerprint is not None:
+            self._repo_histories[repo_history_key] = {
+                'fingerprint': repo_fingerprint,
+                'history': repo_history
+            }
+
+            self._save_repo_histories()
+
+        return repo_history
+
+    def _process_history(self, options: dict, rss_write_enable: bool = True) -> str:
         self.logger.debug(f'History statement found, options: {options}')
 
         repo_urls = options.get('repos', self.options['repos'])
@@ -504,66 +702,16 @@ class Preprocessor(BasePreprocessor):
         history = []
 
         for repo_url in repo_urls:
-            self.logger.debug('Calling Includes preprocessor to fetch from Git repo')
-
-            repo_path = includes.Preprocessor(
-                self.context,
-                self.logger
-            )._sync_repo(repo_url, revision)
-
-            self.logger.debug(f'Repo URL: {repo_url}, path: {repo_path}')
-
-            repo_name = None
-
-            if name_from_readme_enable:
-                self.logger.debug('Trying to get repo name from README')
-
-                readme_file_path = (repo_path / readme_file_subpath).resolve()
-
-                self.logger.debug(f'Full README file path: {readme_file_path}')
-
-                if readme_file_path.exists():
-                    repo_name = self._get_repo_name_from_readme(readme_file_path)
-
-                else:
-                    self.logger.debug('README file not found')
-
-            if not repo_name:
-                self.logger.debug('Getting repo name from repo URL')
-
-                repo_name = repo_url.split('/')[-1].rsplit('.', maxsplit=1)[0]
-
-            self.logger.debug(f'Repo name: {repo_name}')
-
-            self.logger.debug(f'Getting repo history, data source: {data_source}')
-
-            repo_history = None
-
-            if data_source == 'changelog':
-                changelog_file_path = (repo_path / changelog_file_subpath).resolve()
-
-                self.logger.debug(f'Full changelog file path: {changelog_file_path}')
-
-                if changelog_file_path.exists():
-                    repo_history = self._get_repo_history_from_changelog(
-                        repo_url, repo_name, changelog_file_path, source_heading_level
-                    )
-
-                else:
-                    self.logger.debug('Changelog file not found')
-
-            elif data_source == 'tags':
-                repo_history = self._get_repo_history_from_tags(
-                    repo_url, repo_name, repo_path.resolve()
-                )
-
-            elif data_source == 'commits':
-                repo_history = self._get_repo_history_from_commits(
-                    repo_url, repo_name, repo_path.resolve(), merge_commits_enable
-                )
-
-            else:
-                self.logger.debug('Unsupported data source')
+            repo_history = self._get_repo_history(
+                repo_url,
+                revision,
+                name_from_readme_enable,
+                readme_file_subpath,
+                data_source,
+                merge_commits_enable,
+                changelog_file_subpath,
+                source_heading_level
+            )
 
             if repo_history:
                 self.logger.debug(f'Repo history: {repo_history}')
@@ -584,7 +732,7 @@ class Preprocessor(BasePreprocessor):
             limit
         )
 
-        if rss_enable:
+        if rss_enable and rss_write_enable:
             self.logger.debug('Generating history RSS content')
 
             self._generate_history_rss(
@@ -601,12 +749,195 @@ class Preprocessor(BasePreprocessor):
 
         return history_markdown
 
-    def process_history(self, content: str) -> str:
-        def _sub(history_statement) -> str:
-            return self._process_history(
-                self.get_options(history_statement.group('options'))
+    def _watch_history_statement(self, options: dict, history_markdown: str) -> str:
+        repo_urls = options.get('repos', self.options['repos'])
+
+        if not isinstance(repo_urls, list):
+            repo_urls = [repo_urls]
+
+        watched_statement = {
+            'id': len(self._watched_statements),
+            'options': options,
+            'repo_urls': set(repo_urls)
+        }
+
+        self._watched_statements.append(watched_statement)
+
+        if options.get('rss', self.options['rss']):
+            rss_file_subpath = options.get('rss_file', self.options['rss_file'])
+
+            self.logger.debug(f'RSS file {rss_file_subpath} will be regenerated with options: {options}')
+
+            self._watched_rss_files[rss_file_subpath] = watched_statement
+
+        return self._mark_history_markdown(watched_statement['id'], history_markdown)
+
+    def _mark_history_markdown(self, statement_id: int, history_markdown: str) -> str:
+        return f'<!-- history:{statement_id} -->\n{history_markdown}<!-- /history:{statement_id} -->'
+
+    def _write_file_atomically(self, file_path: Path, content: str) -> None:
+        temporary_file_path = file_path.with_name(f'.{file_path.name}.history')
+
+        with open(temporary_file_path, 'w', encoding='utf8') as temporary_file:
+            temporary_file.write(content)
+
+        replace(temporary_file_path, file_path)
+
+        return None
+
+    def _regenerate_histories(self, changed_repo_urls: set) -> dict:
+        regenerated_histories = {}
+
+        for watched_statement in self._watched_statements:
+            if not watched_statement['repo_urls'] & changed_repo_urls:
+                continue
+
+            self.logger.debug(f'Regenerating history with options: {watched_statement["options"]}')
+
+            rss_file_subpath = watched_statement['options'].get('rss_file', self.options['rss_file'])
+
+            try:
+                regenerated_histories[watched_statement['id']] = self._process_history(
+                    watched_statement['options'],
+                    rss_write_enable=self._watched_rss_files.get(rss_file_subpath) is watched_statement
+                )
+
+            except Exception as exception:
+                self.logger.error(
+                    f'Cannot regenerate history with options {watched_statement["options"]}: {exception}'
+                )
+
+        return regenerated_histories
+
+    def _splice_histories(self, regenerated_histories: dict) -> None:
+        spliced_statement_ids = set()
+
+        def _sub(marked_history) -> str:
+            statement_id = int(marked_history.group('id'))
+
+            if statement_id not in regenerated_histories:
+                return marked_history.group(0)
+
+            spliced_statement_ids.add(statement_id)
+
+            return self._mark_history_markdown(statement_id, regenerated_histories[statement_id])
+
+        for markdown_file_path in self.working_dir.rglob('*.md'):
+            try:
+                with open(markdown_file_path, encoding='utf8') as markdown_file:
+                    content = markdown_file.read()
+
+                processed_content = self._marked_history_pattern.sub(_sub, content)
+
+                if processed_content != content:
+                    self.logger.info(f'Regenerating history in Markdown file: {markdown_file_path}')
+
+                    self._write_file_atomically(markdown_file_path, processed_content)
+
+            except Exception as exception:
+                if not self.working_dir.exists():
+                    self.logger.debug('Working directory removed, skipping Markdown files')
+
+                    return None
+
+                self.logger.error(f'Cannot regenerate history in {markdown_file_path}: {exception}')
+
+        for statement_id in regenerated_histories.keys() - spliced_statement_ids:
+            self.logger.warning(
+                f'Generated history {statement_id} not found, ' +
+                'its markers may be removed by other preprocessors; skipping'
             )
 
+        return None
+
+    def _watch(self) -> None:
+        self.logger.info(f'Watching repos for changes, polling interval: {self.options["watch_interval"]} s')
+
+        while not self._watch_stop.wait(self.options['watch_interval']):
+            if not self.working_dir.exists():
+                self.logger.info('Working directory removed, stopping watching')
+
+                break
+
+            previous_repo_fingerprints = self._repo_fingerprints
+
+            self._repo_fingerprints = {}
+
+            changed_repo_urls = set()
+
+            for repo_url, previous_repo_fingerprint in previous_repo_fingerprints.items():
+                repo_fingerprint = self._get_repo_fingerprint(repo_url)
+
+                if repo_fingerprint is not None and repo_fingerprint != previous_repo_fingerprint:
+                    changed_repo_urls.add(repo_url)
+
+            if not changed_repo_urls:
+                continue
+
+            self.logger.info(f'Changes found in repos: {", ".join(sorted(changed_repo_urls))}')
+
+            regenerated_histories = self._regenerate_histories(changed_repo_urls)
+
+            self._splice_histories(regenerated_histories)
+
+        return None
+
+    def _stop_watching(self) -> None:
+        self._watch_stop.set()
+
+        return None
+
+    def _watch_after_build(self) -> None:
+        if getattr(sys, 'last_value', None) is not None:
+            watch_message = f'Build failed, not watching history repos: {sys.last_value}'
+
+        elif not self.working_dir.exists():
+            watch_message = 'Working directory removed after build, not watching history repos; use --keep-tmp'
+
+        else:
+            watch_message = None
+
+        if watch_message:
+            self.logger.warning(watch_message)
+
+            print(watch_message)
+
+            return None
+
+        watch_message = f'Watching history repos, regenerating files in {self.working_dir}; press Ctrl+C to stop'
+
+        self.logger.warning(watch_message)
+
+        print(watch_message)
+
+        self._watch_thread = Thread(target=self._watch, name='history-watch', daemon=True)
+
+        self._watch_thread.start()
+
+        try:
+            while self._watch_thread.is_alive():
+                self._watch_thread.join(1)
+
+        except KeyboardInterrupt:
+            self.logger.info('Interrupted, stopping watching')
+
+            self._stop_watching()
+
+            self._watch_thread.join()
+
+        return None
+
+    def process_history(self, content: str, markdown_file_path: Path = None) -> str:
+        def _sub(history_statement) -> str:
+            options = self.get_options(history_statement.group('options'))
+
+            history_markdown = self._process_history(options)
+
+            if self._watch_enable and markdown_file_path:
+                history_markdown = self._watch_history_statement(options, history_markdown)
+
+            return history_markdown
+
         processed_content = self.pattern.sub(_sub, content)
 
         return processed_content
@@ -620,10 +951,15 @@ class Preprocessor(BasePreprocessor):
             with open(markdown_file_path, encoding='utf8') as markdown_file:
                 content = markdown_file.read()
 
-            processed_content = self.process_history(content)
+            processed_content = self.process_history(content, markdown_file_path)
 
             if processed_content:
                 with open(markdown_file_path, 'w', encoding='utf8') as markdown_file:
                     markdown_file.write(processed_content)
 
+        if self._watched_statements:
+            self.logger.debug(f'Repos will be watched after build, history statements: {self._watched_statements}')
+
+            register(self._watch_after_build)
+
         self.logger.info('Preprocessor applied')
@@ -0,0 +1,344 @@
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from pathlib import Path
+from subprocess import run, PIPE, STDOUT
+from threading import Thread, Timer
+from unittest import mock
+
+from foliant.preprocessors import history, includes
+
+
+GIT_ENV = {
+    'GIT_AUTHOR_NAME': 'Test',
+    'GIT_AUTHOR_EMAIL': 'test@example.com',
+    'GIT_COMMITTER_NAME': 'Test',
+    'GIT_COMMITTER_EMAIL': 'test@example.com'
+}
+
+
+def git(command: str, cwd: Path) -> str:
+    return run(
+        f'git {command}',
+        cwd=cwd,
+        shell=True,
+        check=True,
+        stdout=PIPE,
+        stderr=STDOUT
+    ).stdout.decode('utf8')
+
+
+class TestHistory(unittest.TestCase):
+    def setUp(self):
+        self.env_patcher = mock.patch.dict(os.environ, {**GIT_ENV, 'FOLIANT_HISTORY_WATCH': '1'})
+        self.env_patcher.start()
+
+        self.temp_dir = Path(tempfile.mkdtemp())
+        self.project_path = self.temp_dir / 'project'
+        self.working_dir = self.project_path / '__folianttmp__'
+        self.working_dir.mkdir(parents=True)
+
+        self.repo_urls = {}
+
+        for repo_name in ('first', 'second'):
+            self.repo_urls[repo_name] = self._create_repo(repo_name)
+
+        self.sync_repo = includes.Preprocessor._sync_repo
+
+    def tearDown(self):
+        self.env_patcher.stop()
+
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def _create_repo(self, repo_name: str) -> str:
+        bare_repo_path = self.temp_dir / f'{repo_name}.git'
+        work_repo_path = self.temp_dir / f'{repo_name}_work'
+
+        git(f'init --bare "{bare_repo_path}"', self.temp_dir)
+        git(f'clone "{bare_repo_path}" "{work_repo_path}"', self.temp_dir)
+        git('commit --allow-empty -m "Initial commit"', work_repo_path)
+        git(f'tag -a 1.0.0 -m "{repo_name} 1.0.0 release"', work_repo_path)
+        git('push --follow-tags origin HEAD', work_repo_path)
+
+        return f'file://{bare_repo_path}'
+
+    def _add_tag(self, repo_name: str, tag: str) -> None:
+        work_repo_path = self.temp_dir / f'{repo_name}_work'
+
+        git(f'commit --allow-empty -m "Prepare {tag}"', work_repo_path)
+        git(f'tag -a {tag} -m "{repo_name} {tag} release"', work_repo_path)
+        git('push --follow-tags origin HEAD', work_repo_path)
+
+    def _get_preprocessor(self) -> history.Preprocessor:
+        return history.Preprocessor(
+            {
+                'project_path': self.project_path,
+                'config': {'tmp_dir': '__folianttmp__', 'src_dir': 'src', 'chapters': []},
+                'target': 'site',
+                'backend': 'mkdocs'
+            },
+            logging.getLogger('test'),
+            options={'from': 'tags', 'watch_interval': 0.1}
+        )
+
+    def _count_syncs(self, preprocessor: history.Preprocessor, content: str) -> list:
+        synced_repo_urls = []
+
+        def _sync_repo(includes_preprocessor, repo_url, revision=None, tag_position=None):
+            synced_repo_urls.append(repo_url)
+
+            return self.sync_repo(includes_preprocessor, repo_url, revision, tag_position)
+
+        with mock.patch.object(includes.Preprocessor, '_sync_repo', _sync_repo):
+            preprocessor.process_history(content)
+
+        return synced_repo_urls
+
+    def _wait_for(self, condition) -> bool:
+        deadline = time.monotonic() + 10
+
+        while time.monotonic() < deadline:
+            if condition():
+                return True
+
+            time.sleep(0.05)
+
+        return False
+
+    def test_cached_history_reused_while_refs_unchanged(self):
+        preprocessor = self._get_preprocessor()
+        content = f'<history repos="{self.repo_urls["first"]}"></history>'
+
+        self.assertEqual(self._count_syncs(preprocessor, content), [self.repo_urls['first']])
+
+        preprocessor._repo_fingerprints = {}
+
+        self.assertEqual(self._count_syncs(preprocessor, content), [])
+
+    def test_new_tag_invalidates_only_changed_repo(self):
+        preprocessor = self._get_preprocessor()
+        content = (
+            f'<history repos="[{self.repo_urls["first"]}, {self.repo_urls["second"]}]"></history>'
+        )
+
+        self.assertEqual(len(self._count_syncs(preprocessor, content)), 2)
+
+        self._add_tag('first', '2.0.0')
+
+        preprocessor._repo_fingerprints = {}
+
+        self.assertEqual(self._count_syncs(preprocessor, content), [self.repo_urls['first']])
+        self.assertIn('first 2.0.0 release', preprocessor.process_history(content))
+
+    def test_repos_not_fingerprinted_without_watch(self):
+        with mock.patch.dict(os.environ, {'FOLIANT_HISTORY_WATCH': ''}):
+            preprocessor = self._get_preprocessor()
+
+        content = f'<history repos="{self.repo_urls["first"]}"></history>'
+
+        with mock.patch.object(preprocessor, '_get_repo_fingerprint') as get_repo_fingerprint:
+            self.assertEqual(len(self._count_syncs(preprocessor, content)), 1)
+            self.assertEqual(len(self._count_syncs(preprocessor, content)), 1)
+
+        get_repo_fingerprint.assert_not_called()
+
+    def test_cached_histories_reused_by_next_build(self):
+        content = f'<history repos="{self.repo_urls["first"]}"></history>'
+
+        self.assertEqual(len(self._count_syncs(self._get_preprocessor(), content)), 1)
+        self.assertEqual(self._count_syncs(self._get_preprocessor(), content), [])
+
+    def _apply(self, preprocessor: history.Preprocessor) -> None:
+        with mock.patch('foliant.preprocessors.history.register') as register:
+            preprocessor.apply()
+
+        register.assert_called_once_with(preprocessor._watch_after_build)
+
+        self.assertIsNone(preprocessor._watch_thread)
+
+    def _start_watching(self, preprocessor: history.Preprocessor) -> None:
+        preprocessor._watch_thread = Thread(target=preprocessor._watch, daemon=True)
+        preprocessor._watch_thread.start()
+
+    def _stop_watching(self, preprocessor: history.Preprocessor) -> None:
+        preprocessor._stop_watching()
+        preprocessor._watch_thread.join(5)
+
+        self.assertFalse(preprocessor._watch_thread.is_alive())
+
+    def test_watch_regenerates_only_affected_files_and_rss(self):
+        first_file_path = self.working_dir / 'first.md'
+        second_file_path = self.working_dir / 'second.md'
+        both_file_path = self.working_dir / 'both.md'
+
+        first_file_path.write_text(
+            f'Intro\n\n<history repos="{self.repo_urls["first"]}" rss="true"></history>\n',
+            encoding='utf8'
+        )
+        second_file_path.write_text(
+            f'<history repos="{self.repo_urls["second"]}"></history>\n',
+            encoding='utf8'
+        )
+        both_file_path.write_text(
+            f'<history repos="[{self.repo_urls["first"]}, {self.repo_urls["second"]}]" rss="true"></history>\n',
+            encoding='utf8'
+        )
+
+        preprocessor = self._get_preprocessor()
+
+        self._apply(preprocessor)
+
+        docs_dir = self.working_dir / 'site.mkdocs.src' / 'docs'
+        docs_dir.mkdir(parents=True)
+
+        for file_name in ('first.md', 'second.md', 'both.md', 'rss.xml'):
+            (self.working_dir / file_name).rename(docs_dir / file_name)
+
+        first_file_path = docs_dir / 'first.md'
+        second_file_path = docs_dir / 'second.md'
+        both_file_path = docs_dir / 'both.md'
+
+        with open(first_file_path, 'a', encoding='utf8') as first_file:
+            first_file.write('\nAdded by a later preprocessor\n')
+
+        second_file_content = second_file_path.read_text(encoding='utf8')
+
+        with mock.patch.object(
+            preprocessor,
+            '_generate_history_rss',
+            wraps=preprocessor._generate_history_rss
+        ) as generate_history_rss:
+            self._start_watching(preprocessor)
+            self._add_tag('first', '2.0.0')
+
+            self.assertTrue(
+                self._wait_for(
+                    lambda: all(
+                        'first 2.0.0 release' in file_path.read_text(encoding='utf8')
+                        for file_path in (first_file_path, both_file_path)
+                    )
+                )
+            )
+
+            self._stop_watching(preprocessor)
+
+        first_file_content = first_file_path.read_text(encoding='utf8')
+
+        self.assertTrue(first_file_content.startswith('Intro\n\n'))
+        self.assertIn('Added by a later preprocessor', first_file_content)
+        self.assertEqual(second_file_path.read_text(encoding='utf8'), second_file_content)
+
+        generate_history_rss.assert_called_once()
+
+        self.assertFalse((self.working_dir / 'rss.xml').exists())
+        self.assertIn('first 2.0.0 release', (docs_dir / 'rss.xml').read_text(encoding='utf8'))
+
+    def test_watch_regenerates_repeated_statements_separately(self):
+        markdown_file_path = self.working_dir / 'index.md'
+
+        markdown_file_path.write_text(
+            f'<history repos="{self.repo_urls["first"]}"></history>\n\n' +
+            f'<history repos="{self.repo_urls["first"]}"></history>\n\n' +
+            f'<history repos="[{self.repo_urls["first"]}, {self.repo_urls["second"]}]"></history>\n',
+            encoding='utf8'
+        )
+
+        preprocessor = self._get_preprocessor()
+
+        self._apply(preprocessor)
+        self._start_watching(preprocessor)
+        self._add_tag('first', '2.0.0')
+
+        self.assertTrue(
+            self._wait_for(
+                lambda: markdown_file_path.read_text(encoding='utf8').count('first 2.0.0 release') >= 3
+            )
+        )
+
+        self._stop_watching(preprocessor)
+
+        content = markdown_file_path.read_text(encoding='utf8')
+
+        self.assertEqual(content.count('first 2.0.0 release'), 3)
+        self.assertEqual(content.count('first 1.0.0 release'), 3)
+        self.assertEqual(content.count('second 1.0.0 release'), 1)
+
+    def test_watch_continues_after_statement_error(self):
+        rss_file_path = self.working_dir / 'rss.md'
+        plain_file_path = self.working_dir / 'plain.md'
+
+        rss_file_path.write_text(
+            f'<history repos="{self.repo_urls["first"]}" rss="true"></history>\n',
+            encoding='utf8'
+        )
+        plain_file_path.write_text(
+            f'<history repos="{self.repo_urls["first"]}"></history>\n',
+            encoding='utf8'
+        )
+
+        preprocessor = self._get_preprocessor()
+
+        self._apply(preprocessor)
+
+        with mock.patch.object(preprocessor, '_generate_history_rss', side_effect=ValueError('Bad date')):
+            self._start_watching(preprocessor)
+            self._add_tag('first', '2.0.0')
+
+            self.assertTrue(
+                self._wait_for(
+                    lambda: 'first 2.0.0 release' in plain_file_path.read_text(encoding='utf8')
+                )
+            )
+
+            self.assertTrue(preprocessor._watch_thread.is_alive())
+
+            self._stop_watching(preprocessor)
+
+        self.assertNotIn('first 2.0.0 release', rss_file_path.read_text(encoding='utf8'))
+
+    def test_watch_after_build_skipped_when_build_failed(self):
+        preprocessor = self._get_preprocessor()
+
+        with mock.patch.object(sys, 'last_value', RuntimeError('Backend failed'), create=True):
+            with mock.patch.object(preprocessor, '_watch') as watch:
+                preprocessor._watch_after_build()
+
+        watch.assert_not_called()
+
+        self.assertIsNone(preprocessor._watch_thread)
+
+    def test_watch_after_build_waits_until_stopped(self):
+        preprocessor = self._get_preprocessor()
+
+        Timer(0.3, preprocessor._stop_watching).start()
+
+        with mock.patch.object(sys, 'last_value', None, create=True):
+            preprocessor._watch_after_build()
+
+        self.assertFalse(preprocessor._watch_thread.is_alive())
+
+    def test_watch_stops_when_working_dir_removed(self):
+        (self.working_dir / 'index.md').write_text(
+            f'<history repos="{self.repo_urls["first"]}"></history>\n',
+            encoding='utf8'
+        )
+
+        preprocessor = self._get_preprocessor()
+
+        self._apply(preprocessor)
+
+        shutil.rmtree(self.working_dir)
+
+        self._start_watching(preprocessor)
+
+        preprocessor._watch_thread.join(5)
+
+        self.assertFalse(preprocessor._watch_thread.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()